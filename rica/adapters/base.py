@@ -1,10 +1,11 @@
 import asyncio
-import functools
+import itertools
 import json
 import logging
 import re
+import time
 from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
-from uuid import uuid4
+from uuid import UUID, uuid4
 
 from rica.core.application import CallBack, RiCA, Route
 from rica.exceptions import (
@@ -17,13 +18,77 @@ from rica.exceptions import (
 from rica.utils.package_loader import load_app_from_path
 from rica.utils.parser import parse_rica_tag
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 __all__ = ["ReasoningThreadBase"]
 
-# Configure logger
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
+
+try:
+    # google-re2 matches in linear time without backtracking; `re` is the fallback.
+    import re2 as _tag_re
+except ImportError:
+    _tag_re = re
+
+# Inline flags keep the patterns portable between `re` and `re2`.
+_RICA_TAG_RE = _tag_re.compile(r"(?is)<rica\s+[^>]*>.*?</rica>")
+
+# The canonical form of the most frequent tag, which `_parse_and_execute` handles directly.
+_RESPONSE_PREFIX = '<rica package="rica" route="/response">'
+_RESPONSE_SUFFIX = "</rica>"
+
+
+def _find_tag_start(text: str, start: int = 0) -> int:
+    """
+    Return the index of the first "<" at or after `start` that may open a <rica> tag, or -1.
+
+    That is "<rica" followed by whitespace, or a "<" near the end followed by a prefix of
+    it, since the rest of the tag may still be on its way.
+    """
+    i = text.find("<", start)
+    while i != -1:
+        head = text[i + 1 : i + 6]
+        if len(head) == 5:
+            if head[:4].lower() == "rica" and head[4].isspace():
+                return i
+        elif "rica".startswith(head[:4].lower()):
+            return i
+        i = text.find("<", i + 1)
+    return -1
+
+
+def _dumps(obj: Any) -> str:
+    """Serialize a tool result to compact JSON, with orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass  # e.g. integers wider than 64 bits; let the stdlib encoder decide
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+# Call ids only need to be unique within this process: a random prefix drawn once plus a
+# counter keeps them UUID-shaped without reading the OS random source on every tool call.
+_CALL_ID_PREFIX = uuid4().int >> 64 << 64
+_call_counter = itertools.count()
+
+
+def _next_call_id() -> UUID:
+    return UUID(int=_CALL_ID_PREFIX | next(_call_counter))
+
+
+def _log_task_error(task: asyncio.Task):
+    """Done-callback for background tasks nobody awaits."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background task %s failed", task.get_name(), exc_info=task.exception())
+
+
+async def _call_inline(function: Callable[[Any], Any], data: Any) -> Any:
+    """Run a non-blocking synchronous tool on the event loop."""
+    return function(data)
 
 
 class ReasoningThreadBase:
@@ -39,11 +104,11 @@ class ReasoningThreadBase:
     - Detecting and executing <rica ...>...</rica> tool calls.
 
     Attributes:
-        _apps: A dictionary of installed RiCA applications.
-        _context: The textual context buffer.
+        _apps: A dictionary of installed RiCA applications, replaced (never mutated) on change.
+        _context: The textual context buffer, stored as appended chunks and joined lazily.
     """
 
-    def __init__(self, context: str = ""):
+    def __init__(self, context: str = "", max_parallel_tools: int = 8):
         """
         Initializes the reasoning thread.
 
@@ -53,22 +118,50 @@ class ReasoningThreadBase:
 
         Args:
             context: The initial context string.
+            max_parallel_tools: How many tool calls from one generation step may run at once.
         """
         self._apps: Dict[str, RiCA] = {}
-        self._apps_lock = asyncio.Lock()
-        self._context: str = context or ""
+        # Resolved (package, route) pairs; rebuilt whenever the installed apps change.
+        self._route_cache: Dict[tuple[str, str], Route] = {}
+        # asyncio primitives are created on first use, inside the loop that uses them.
+        self._apps_lock: Optional[asyncio.Lock] = None
+        self._context_chunks: List[str] = []
+        self._context_cache: Optional[str] = None
+        self._context_len: int = 0
+        self._last_scanned_index: int = 0  # Text before this holds no unfinished tool tag
+        self._context = context or ""
         self._last_processed_index: int = 0  # Tracks the end of the last processed tool tag
-        self._response_callbacks: List[Callable[[Any], Any]] = []  # For @trigger
-        self._token_callbacks: List[Callable[[str], Any]] = []  # For @token_generated
+        # Callbacks are split into async and sync lists at registration time so emitting
+        # never has to introspect them.
+        self._response_async_cbs: List[Callable[[Any], Any]] = []  # For @trigger
+        self._response_sync_cbs: List[Callable[[Any], Any]] = []
+        self._token_async_cbs: List[Callable[[str], Any]] = []  # For @token_generated
+        self._token_sync_cbs: List[Callable[[str], Any]] = []
+        # Emitted pieces not yet handed to @token_generated callbacks, and the one task
+        # delivering them.
+        self._token_pending: List[str] = []
+        self._token_delivery: Optional[asyncio.Task] = None
+        # The loop only keeps weak references to tasks; background tool calls live here until
+        # they finish so they cannot be garbage-collected mid-flight.
+        self._pending_tasks: set[asyncio.Future] = set()
+        self._max_parallel_tools = max_parallel_tools
+        self._tool_semaphore: Optional[asyncio.Semaphore] = None
         self._initialized = False
+        self._init_lock: Optional[asyncio.Lock] = None
 
     async def initialize(self):
         """Initialize the reasoning thread by installing system apps."""
         if self._initialized:
             return
-        # Install the virtual 'rica' app for system prompts
-        await self.install(RiCA("rica"))
-        self._initialized = True
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        # Concurrent callers wait for the first one instead of installing 'rica' twice.
+        async with self._init_lock:
+            if self._initialized:
+                return
+            # Install the virtual 'rica' app for system prompts
+            await self.install(RiCA("rica"))
+            self._initialized = True
 
     async def install(self, app: Union[RiCA, str]):
         """
@@ -92,12 +185,16 @@ class ReasoningThreadBase:
         else:
             raise TypeError("The 'app' argument must be an instance of RiCA or a file path string.")
 
-        async with self._apps_lock:
+        async with self._get_apps_lock():
             if app_instance.package in self._apps:
                 raise PackageExistError(
                     f"Application with package '{app_instance.package}' is already installed."
                 )
-            self._apps[app_instance.package] = app_instance
+            # Publish a new dict instead of mutating in place so readers never need the lock.
+            apps = dict(self._apps)
+            apps[app_instance.package] = app_instance
+            self._apps = apps
+            self._route_cache = {}
 
     async def uninstall(self, package_name: str):
         """
@@ -109,10 +206,19 @@ class ReasoningThreadBase:
         Raises:
             PackageNotFoundError: If the application with the given package name is not found.
         """
-        async with self._apps_lock:
+        async with self._get_apps_lock():
             if package_name not in self._apps:
                 raise PackageNotFoundError(f"Application with package '{package_name}' not found.")
-            del self._apps[package_name]
+            apps = dict(self._apps)
+            del apps[package_name]
+            self._apps = apps
+            self._route_cache = {}
+
+    def _get_apps_lock(self) -> asyncio.Lock:
+        """Return the lock serializing app installs, creating it on first use."""
+        if self._apps_lock is None:
+            self._apps_lock = asyncio.Lock()
+        return self._apps_lock
 
     # ---- Lifecycle placeholders (to be implemented by subclasses) ----
     async def insert(self, text: Any):
@@ -140,13 +246,52 @@ class ReasoningThreadBase:
         """Return the current textual context buffer."""
         return self._context
 
+    @property
+    def _context(self) -> str:
+        # Joining is deferred until someone reads the whole buffer; the result is cached
+        # and replaces the chunk list, so repeated reads are free.
+        if self._context_cache is None:
+            self._context_cache = "".join(self._context_chunks)
+            self._context_chunks = [self._context_cache]
+        return self._context_cache
+
+    @_context.setter
+    def _context(self, value: str):
+        self._context_chunks = [value]
+        self._context_cache = value
+        self._context_len = len(value)
+        # Replacing the buffer invalidates whatever the tool scanner already covered.
+        self._last_scanned_index = 0
+
+    def _append_context(self, text: str):
+        """Append text to the context in O(len(text))."""
+        if not text:
+            return
+        self._context_chunks.append(text)
+        self._context_cache = None
+        self._context_len += len(text)
+
+    def _context_since(self, start: int) -> str:
+        """Return `context[start:]` without materializing the whole buffer."""
+        remaining = self._context_len - max(start, 0)
+        pieces = []
+        for chunk in reversed(self._context_chunks):
+            if remaining <= 0:
+                break
+            pieces.append(chunk if len(chunk) <= remaining else chunk[-remaining:])
+            remaining -= len(chunk)
+        return "".join(reversed(pieces))
+
     # ---- Common helpers ----
     def trigger(self, function: Callable[..., Any]) -> Callable[..., Any]:
         """
         Register a callback that will be called for `rica.response` tool calls.
         This is for delivering final responses to the user.
         """
-        self._response_callbacks.append(function)
+        if asyncio.iscoroutinefunction(function):
+            self._response_async_cbs.append(function)
+        else:
+            self._response_sync_cbs.append(function)
         return function
 
     def token_generated(self, function: Callable[[str], Any]) -> Callable[[str], Any]:
@@ -154,46 +299,85 @@ class ReasoningThreadBase:
         Register a callback that will be called for every token generated by the model.
         This is for observing the model's "thinking" process.
         """
-        self._token_callbacks.append(function)
+        if asyncio.iscoroutinefunction(function):
+            self._token_async_cbs.append(function)
+        else:
+            self._token_sync_cbs.append(function)
         return function
 
     async def _emit_response(self, payload: Any):
         """Emit a final response payload to all @trigger callbacks."""
         if not payload:
             return
-        tasks = [
-            asyncio.create_task(cb(payload))
-            for cb in self._response_callbacks
-            if asyncio.iscoroutinefunction(cb)
-        ]
-        tasks.extend(
-            [
-                asyncio.create_task(asyncio.to_thread(cb, payload))
-                for cb in self._response_callbacks
-                if not asyncio.iscoroutinefunction(cb)
-            ]
-        )
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+        await self._dispatch(self._response_async_cbs, self._response_sync_cbs, payload)
 
-    async def _emit_token(self, piece: str):
-        """Emit a raw generated token to all @token_generated callbacks."""
-        if not piece:
+    async def _emit_token(self, piece: str, ordered: bool = False):
+        """
+        Emit a raw generated token to all @token_generated callbacks.
+
+        Delivery happens in the background, in emission order, so a slow observer does not
+        hold up generation. Pieces emitted while the callbacks are still busy are joined and
+        delivered in one call, so the backlog never grows beyond one string. With
+        `ordered=True` this waits until the piece, and every piece emitted before it, has
+        been delivered.
+        """
+        if not piece or not (self._token_async_cbs or self._token_sync_cbs):
             return
-        tasks = [
-            asyncio.create_task(cb(piece))
-            for cb in self._token_callbacks
-            if asyncio.iscoroutinefunction(cb)
-        ]
-        tasks.extend(
-            [
-                asyncio.create_task(asyncio.to_thread(cb, piece))
-                for cb in self._token_callbacks
-                if not asyncio.iscoroutinefunction(cb)
-            ]
-        )
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
+        self._token_pending.append(piece)
+        if self._token_delivery is None or self._token_delivery.done():
+            task = asyncio.create_task(self._deliver_tokens())
+            task.add_done_callback(_log_task_error)
+            self._token_delivery = task
+        if ordered:
+            await self._drain_token_emits()
+
+    async def _deliver_tokens(self):
+        pending = self._token_pending
+        while pending:
+            text = "".join(pending)
+            pending.clear()
+            await self._dispatch(self._token_async_cbs, self._token_sync_cbs, text)
+
+    async def _drain_token_emits(self, timeout: Optional[float] = None):
+        """
+        Wait until every emitted token has been delivered to the callbacks. If that takes
+        longer than `timeout` seconds, cancel the delivery and drop what is still pending.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self._token_delivery is not None and not self._token_delivery.done():
+            remaining = None if deadline is None else max(deadline - loop.time(), 0)
+            done, _ = await asyncio.wait((self._token_delivery,), timeout=remaining)
+            if not done:
+                logger.warning(
+                    "@token_generated callbacks did not finish within %ss; dropping the rest",
+                    timeout,
+                )
+                self._token_delivery.cancel()
+                self._token_pending.clear()
+                return
+
+    @staticmethod
+    async def _dispatch(
+        async_cbs: List[Callable[[Any], Any]], sync_cbs: List[Callable[[Any], Any]], arg: Any
+    ):
+        """Run every callback with `arg`, logging rather than raising their errors."""
+        # A lone callback is awaited directly; tasks and `gather` are only worth it when
+        # there is something to run concurrently.
+        if len(async_cbs) + len(sync_cbs) == 1:
+            try:
+                if async_cbs:
+                    await async_cbs[0](arg)
+                else:
+                    await asyncio.to_thread(sync_cbs[0], arg)
+            except Exception as e:
+                logger.error("Callback failed: %s", e, exc_info=e)
+            return
+        tasks = [asyncio.create_task(cb(arg)) for cb in async_cbs]
+        tasks.extend(asyncio.create_task(asyncio.to_thread(cb, arg)) for cb in sync_cbs)
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error("Callback failed: %s", result, exc_info=result)
 
     async def _execute_tool_call(
         self, app: Route, data: list | dict
@@ -212,33 +396,45 @@ class ReasoningThreadBase:
         timeout = app.timeout
         background = app.background
 
-        start_time = asyncio.get_event_loop().time()
+        loop = asyncio.get_running_loop()
+        start_time = time.monotonic()
 
         try:
-            if not asyncio.iscoroutinefunction(function):
-                function = asyncio.to_thread(functools.partial(function, data))
-            else:
+            if app.is_coroutine:
                 function = function(data)
+            elif app.blocking:
+                # A bare executor future skips the context copy `asyncio.to_thread` makes.
+                function = loop.run_in_executor(None, function, data)
+            else:
+                function = _call_inline(function, data)
 
             if background:
-                call_id = uuid4()
-                loop = asyncio.get_running_loop()
-                task = loop.create_task(function, name=str(call_id))
+                call_id = _next_call_id()
+                task = (
+                    loop.create_task(function, name=str(call_id))
+                    if asyncio.iscoroutine(function)
+                    else function
+                )
 
+                cancel_handle = (
+                    loop.call_later(timeout / 1000, task.cancel) if timeout > 0 else None
+                )
+
+                # One done-callback both disarms the timeout timer and reports the outcome.
                 def on_task_done(t):
+                    if cancel_handle is not None:
+                        cancel_handle.cancel()
                     try:
                         if t.cancelled():
-                            logger.warning(f"Task {call_id} was cancelled")
+                            logger.warning("Task %s was cancelled", call_id)
                         elif t.exception():
-                            logger.error(f"Task {call_id} failed", exc_info=t.exception())
+                            logger.error("Task %s failed", call_id, exc_info=t.exception())
                     except Exception as e:
-                        logger.error(f"Error in task callback: {e}")
+                        logger.error("Error in task callback: %s", e)
 
                 task.add_done_callback(on_task_done)
-
-                if timeout > 0:
-                    cancel_handle = loop.call_later(timeout / 1000, task.cancel)
-                    task.add_done_callback(lambda _: cancel_handle.cancel())
+                self._pending_tasks.add(task)
+                task.add_done_callback(self._pending_tasks.discard)
                 return call_id
             else:
                 try:
@@ -247,22 +443,22 @@ class ReasoningThreadBase:
                         if timeout > 0
                         else await function
                     )
-                    duration = (asyncio.get_event_loop().time() - start_time) * 1000
+                    duration = (time.monotonic() - start_time) * 1000
                     return CallBack(
-                        package=app.route.split("/")[0],
+                        package=app.package,
                         route=app.route,
-                        call_id=uuid4(),
+                        call_id=_next_call_id(),
                         callback=result,
                         duration_ms=duration,
                     )
                 except asyncio.TimeoutError as e:
-                    logger.error(f"Tool call timed out after {timeout}ms")
+                    logger.error("Tool call timed out after %dms", timeout)
                     raise ExecutionTimedOut from e
                 except Exception as e:
-                    logger.error(f"Tool execution failed: {e}", exc_info=True)
+                    logger.error("Tool execution failed: %s", e, exc_info=True)
                     raise UnexpectedExecutionError(str(e)) from e
         except Exception as e:
-            logger.critical(f"Critical error in _execute_tool_call: {e}", exc_info=True)
+            logger.critical("Critical error in _execute_tool_call: %s", e, exc_info=True)
             raise
 
     async def create_sub_thread(
@@ -273,44 +469,87 @@ class ReasoningThreadBase:
 
     async def _detect_and_execute_tool_tail(self) -> tuple[bool, Optional[str]]:
         """Detect and execute all <rica ...>...</rica> tags in the context."""
-        # Find all tags
-        pattern = re.compile(r"<rica\s+[^>]*>.*?<\/rica>", re.DOTALL | re.IGNORECASE)
-        # Search starting from the last processed index
-        matches = list(pattern.finditer(self._context, self._last_processed_index))
+        # Only text after the last processed tag and not yet known to be tag-free can hold
+        # new tags, so each call scans just that suffix.
+        base = max(self._last_processed_index, self._last_scanned_index)
+        tail = self._context_since(base)
+
+        # Both bookends are located with str.find; the regex only runs once a tag opening
+        # is followed by a "</" that may close it.
+        first = _find_tag_start(tail)
+        if first == -1:
+            self._last_scanned_index = base + len(tail)
+            return False, None
+        if tail.find("</", first) == -1:
+            self._last_scanned_index = base + first
+            return False, None
+
+        matches = list(_RICA_TAG_RE.finditer(tail, first))
+
+        # Resume the next scan at the first tag opening that is still unclosed.
+        tail_start = matches[-1].end() if matches else first
+        pending = _find_tag_start(tail, tail_start)
+        self._last_scanned_index = base + (len(tail) if pending == -1 else pending)
 
         if not matches:
             return False, None
 
-        # Execute all new matches
-        tasks = []
-        for match in matches:
-            tag_text = match.group(0)
-            tasks.append(self._parse_and_execute(tag_text))
-
-        results = await asyncio.gather(*tasks)
+        # Execute all new matches, at most `max_parallel_tools` at a time so a burst of tags
+        # cannot exhaust the default thread pool used by synchronous tools.
+        async with asyncio.TaskGroup() as tg:
+            tasks = [
+                tg.create_task(self._parse_and_execute_guarded(match.group(0))) for match in matches
+            ]
+        results = [task.result() for task in tasks]
 
-        combined_result = ""
-        for res in results:
-            if res:
-                self._context += res
-                await self._emit_token(res)
-                combined_result += res
+        # Results go into the context in tag order, but observers get them in a single call.
+        combined_result = "".join(res for res in results if res)
+        self._append_context(combined_result)
+        await self._emit_token(combined_result)
 
         # Update the processed index to the end of the last matched tag.
-        # We use the match end index directly. Since we haven't modified the context *before* this
-        # point, the indices are valid. The results are appended *after* the current context, so
-        # they don't interfere.
-        if matches:
-            self._last_processed_index = matches[-1].end()
+        # Match offsets are relative to the scanned suffix, so shift them by its start. The
+        # results are appended *after* the current context, so they don't interfere.
+        self._last_processed_index = base + matches[-1].end()
 
         return True, combined_result
 
+    async def _parse_and_execute_guarded(self, tag_text: str) -> str:
+        """Run `_parse_and_execute` once one of the parallel tool slots is free."""
+        if self._tool_semaphore is None:
+            self._tool_semaphore = asyncio.Semaphore(self._max_parallel_tools)
+        async with self._tool_semaphore:
+            return await self._parse_and_execute(tag_text)
+
     async def _parse_and_execute(self, tag_text: str) -> str:
         """Helper to parse and execute a single tag."""
         try:
+            # Fast path for a canonical rica/response tag holding plain JSON: no XML parsing
+            # and no lookups. Markup, entities or bad JSON fall through to the full parser.
+            if tag_text.startswith(_RESPONSE_PREFIX) and tag_text.endswith(_RESPONSE_SUFFIX):
+                body = tag_text[len(_RESPONSE_PREFIX) : -len(_RESPONSE_SUFFIX)]
+                if "<" not in body and "&" not in body:
+                    try:
+                        content = json.loads(body) if body.strip() else {}
+                    except ValueError:
+                        pass
+                    else:
+                        await self._emit_response(content)
+                        return ""
+
             package_name, route_name, content = parse_rica_tag(tag_text)
 
-            async with self._apps_lock:
+            # Special handling for rica/response, the most frequent tag: it never reaches an
+            # app, so skip the lookup and tool-call machinery entirely.
+            if package_name == "rica" and route_name == "/response":
+                await self._emit_response(content)
+                return ""  # No result appended for response
+
+            key = (package_name, route_name)
+            application = self._route_cache.get(key)
+            if application is None:
+                # `_apps` is replaced, never mutated, by install/uninstall, so a plain read is
+                # safe. Only hits are cached, so routes registered later are still found.
                 app_instance = self._apps.get(package_name)
                 if not app_instance:
                     raise PackageNotFoundError(f"Package '{package_name}' not found")
@@ -318,26 +557,18 @@ class ReasoningThreadBase:
                 application = app_instance.find_route(route_name)
                 if not application:
                     raise RouteNotFoundError(f"Route '{route_name}' not found")
-
-            # Special handling for rica/response
-            if package_name == "rica" and route_name == "/response":
-                await self._emit_response(content)
-                return ""  # No result appended for response
+                self._route_cache[key] = application
 
             result = await self._execute_tool_call(application, content)
 
             if isinstance(result, CallBack):
                 payload = result.callback
-                appended = (
-                    json.dumps(payload, ensure_ascii=False)
-                    if isinstance(payload, (dict, list))
-                    else str(payload)
-                )
+                appended = _dumps(payload) if isinstance(payload, (dict, list)) else str(payload)
             else:  # UUID
-                appended = json.dumps({"call_id": str(result)}, ensure_ascii=False)
+                appended = _dumps({"call_id": str(result)})
 
             return appended
 
         except Exception as e:
-            logger.error(f"Tool execution error: {e}", exc_info=True)
+            logger.error("Tool execution error: %s", e, exc_info=True)
             return f"[tool-error]{type(e).__name__}: {e}"
@@ -1,8 +1,15 @@
 from __future__ import annotations
 
 import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import inspect
 import json
-from typing import Any, Dict, Optional
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Literal, Optional
 
 from ..exceptions import AdapterDependenciesImportError
 from ..utils.prompt import _rica_prompt
@@ -13,32 +20,341 @@ try:
     from transformers import (
         AutoModelForCausalLM,
         AutoTokenizer,
+        BitsAndBytesConfig,
         GenerationConfig,
-        StoppingCriteria,
-        StoppingCriteriaList,
-        TextIteratorStreamer,
     )
 except ImportError:
     raise AdapterDependenciesImportError(
         "The transformers adapter requires 'transformers' and 'torch' to be installed."
     )
 
+try:
+    from transformers import StaticCache
+except ImportError:  # Older transformers releases only provide the dynamic cache
+    StaticCache = None
+
+try:
+    from transformers import QuantizedCache
+except ImportError:
+    QuantizedCache = None
+
+try:
+    from transformers.utils import is_flash_attn_2_available
+except ImportError:
+
+    def is_flash_attn_2_available() -> bool:
+        return False
+
+
+try:
+    from tokenizers.decoders import DecodeStream
+except ImportError:  # tokenizers < 0.21
+    DecodeStream = None
+
 from ..config import DEFAULT_MODEL_NAME
 
 default_model_name = DEFAULT_MODEL_NAME
 
+logger = logging.getLogger(__name__)
+
+# Deltas longer than this (typically the initial prompt) are tokenized in a worker thread.
+_OFFLOAD_ENCODE_CHARS = 2048
+
+# Generated text is handed to @token_generated callbacks once this many characters have
+# accumulated or `streaming_batch_ms` has passed since the last hand-off, whichever is first.
+_EMIT_BATCH_CHARS = 16
+
+# KV-cache quantization options mapped to (backend, nbits). quanto only implements 2/4 bits.
+_KV_CACHE_QUANT = {"int2": ("quanto", 2), "int4": ("quanto", 4), "int8": ("hqq", 8)}
+
+# Deltas up to this length are memoized; repeated wrappers and tool payloads skip the tokenizer.
+_CACHED_ENCODE_CHARS = 256
+# Memoized deltas kept per thread, least recently used evicted first.
+_ENCODE_CACHE_SIZE = 512
+
+# Nucleus sampling looks for the nucleus among this many top candidates first and only sorts
+# the whole vocabulary when their probability mass falls short of top_p.
+_TOP_P_CANDIDATES = 64
+
+# How long `wait`/`destroy` give the decode loop and token callbacks before cancelling them.
+_SHUTDOWN_TIMEOUT_S = 5.0
+
+# Longer inputs are prefilled in chunks of this many tokens to bound peak activation memory.
+_PREFILL_CHUNK_TOKENS = 2048
+
+# Generation options the decode loop implements, plus bookkeeping keys that do not change what
+# gets generated. Any other key set in a generation config (repetition_penalty, min_p,
+# num_beams, ...) has no effect.
+_SUPPORTED_GENERATION_KEYS = frozenset(
+    {
+        "max_new_tokens",
+        "do_sample",
+        "temperature",
+        "top_k",
+        "top_p",
+        "eos_token_id",
+        "pad_token_id",
+        "bos_token_id",
+        "use_cache",
+        "output_attentions",
+        "output_hidden_states",
+        "output_scores",
+        "output_logits",
+        "return_dict_in_generate",
+        "_from_model_config",
+        "transformers_version",
+    }
+)
+
+
+def _unsupported_generation_keys(generation_config: GenerationConfig) -> list[str]:
+    """Keys set on `generation_config` that the decode loop does not apply."""
+    return sorted(set(generation_config.to_diff_dict()) - _SUPPORTED_GENERATION_KEYS)
+
+
+def _as_id_set(value: Any) -> set[int]:
+    """Normalize an `eos_token_id`-style value (None, int or list of ints) to a set."""
+    if value is None:
+        return set()
+    if isinstance(value, int):
+        return {value}
+    return {int(v) for v in value}
+
+
+def _cpu_supports_bf16() -> bool:
+    """Whether the CPU has native bf16 matmul support (AVX512-BF16 or AMX)."""
+    for probe in ("_is_avx512_bf16_supported", "_is_amx_tile_supported"):
+        check = getattr(torch.cpu, probe, None)
+        if check is not None and check():
+            return True
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def _default_dtype() -> torch.dtype:
+    """bf16 where it is native, fp16 on older GPUs and fp32 on CPUs without bf16."""
+    if torch.cuda.is_available():
+        # Pre-Ampere GPUs only emulate bf16; fp16 keeps the same weight memory at full speed.
+        return torch.bfloat16 if torch.cuda.get_device_capability()[0] >= 8 else torch.float16
+    return torch.bfloat16 if _cpu_supports_bf16() else torch.float32
+
+
+def _enable_tf32():
+    """Let fp32 matmuls and convolutions run on TF32 tensor cores (Ampere and newer)."""
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+
+
+def _attn_implementations() -> list[str]:
+    """Attention backends to try at load time, fastest first."""
+    candidates = ["sdpa", "eager"]
+    if is_flash_attn_2_available():
+        candidates.insert(0, "flash_attention_2")
+    return candidates
+
+
+def _is_attn_backend_error(error: Exception) -> bool:
+    """Whether a `from_pretrained` failure is the model rejecting its attention backend."""
+    message = str(error).lower()
+    return "attention" in message or "attn" in message
+
+
+def _logits_to_keep_arg(model: AutoModelForCausalLM) -> Optional[str]:
+    """Name of the forward kwarg that limits which positions get LM-head logits, if any."""
+    params = inspect.signature(model.forward).parameters
+    for name in ("logits_to_keep", "num_logits_to_keep"):
+        if name in params:
+            return name
+    return None
+
+
+def _build_quantization_config(
+    quantization: Literal["none", "int8", "nf4"], dtype: torch.dtype
+) -> Optional[BitsAndBytesConfig]:
+    """
+    Translate the `quantization` option into a bitsandbytes config for `from_pretrained`.
+    nf4 weights are dequantized to `dtype`, the dtype the rest of the model is loaded in.
+    """
+    if quantization == "none":
+        return None
+    if quantization == "int8":
+        return BitsAndBytesConfig(load_in_8bit=True)
+    if quantization == "nf4":
+        return BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=dtype,
+        )
+    raise ValueError(f"Unsupported quantization '{quantization}'.")
+
+
+def _pad_to_multiple(input_ids: torch.Tensor, multiple: int, pad_id: int) -> torch.Tensor:
+    """Right-pad `input_ids` to a multiple of `multiple` tokens."""
+    pad = (-input_ids.shape[1]) % multiple
+    if not pad:
+        return input_ids
+    return torch.nn.functional.pad(input_ids, (0, pad), value=pad_id)
+
+
+def _sample_from_probs(probs: torch.Tensor) -> torch.Tensor:
+    """
+    Draw one index per row in proportion to `probs` (which need not be normalized).
+
+    argmax(p / E) with E ~ Exp(1) is the Gumbel-max trick in probability space: one
+    elementwise pass and a reduction instead of multinomial's cumulative-sum search.
+    """
+    noise = torch.empty_like(probs).exponential_()
+    return (probs / noise).argmax(dim=-1, keepdim=True)
+
+
+def _sample_from_sorted(
+    sorted_probs: torch.Tensor, sorted_idx: torch.Tensor, top_p: Optional[float]
+) -> torch.Tensor:
+    """Sample from candidates sorted by descending probability, applying top-p if set."""
+    if top_p is not None and top_p < 1.0:
+        cumulative = sorted_probs.cumsum(dim=-1)
+        # Keep the smallest prefix whose mass reaches top_p (always at least one token).
+        sorted_probs = sorted_probs.masked_fill(cumulative - sorted_probs > top_p, 0.0)
+    choice = _sample_from_probs(sorted_probs)
+    return sorted_idx.gather(-1, choice)
 
-class _ToolCallStoppingCriteria(StoppingCriteria):
-    """Stops generation when a complete <rica>...</rica> tag is detected."""
+
+def _scaled_logits(logits: torch.Tensor, generation_config: GenerationConfig) -> torch.Tensor:
+    """Logits in fp32, divided by the configured temperature."""
+    logits = logits.float()
+    if generation_config.temperature and generation_config.temperature != 1.0:
+        logits = logits / generation_config.temperature
+    return logits
+
+
+def _sample_next_token(
+    logits: torch.Tensor, generation_config: GenerationConfig
+) -> tuple[torch.Tensor, Optional[torch.Tensor]]:
+    """
+    Pick the next token id from last-position logits according to the generation config,
+    without synchronizing with the device.
+
+    Top-p without top-k first looks for the nucleus among the top candidates only. In that
+    case the second value is a device bool telling whether they covered it; when it is
+    False the token is not valid and `_sample_top_p_sorted` has to draw it instead.
+    """
+    if not generation_config.do_sample:
+        return torch.argmax(logits, dim=-1, keepdim=True), None
+
+    logits = _scaled_logits(logits, generation_config)
+    vocab_size = logits.shape[-1]
+    top_k = generation_config.top_k
+    top_p = generation_config.top_p
+    if top_k and top_k < vocab_size:
+        # topk already returns the candidates sorted; softmax over them equals the full
+        # softmax with everything else masked out.
+        values, indices = torch.topk(logits, top_k, dim=-1)
+        return _sample_from_sorted(torch.softmax(values, dim=-1), indices, top_p), None
+
+    if top_p is not None and top_p < 1.0:
+        if _TOP_P_CANDIDATES < vocab_size:
+            values, indices = torch.topk(logits, _TOP_P_CANDIDATES, dim=-1)
+            probs = torch.exp(values - torch.logsumexp(logits, dim=-1, keepdim=True))
+            covered = probs.sum(dim=-1) >= top_p
+            return _sample_from_sorted(probs, indices, top_p), covered
+        return _sample_top_p_sorted(logits, generation_config, scaled=True), None
+
+    return _sample_from_probs(torch.softmax(logits, dim=-1)), None
+
+
+def _sample_top_p_sorted(
+    logits: torch.Tensor, generation_config: GenerationConfig, scaled: bool = False
+) -> torch.Tensor:
+    """Nucleus sampling over the whole vocabulary, sorted by probability."""
+    if not scaled:
+        logits = _scaled_logits(logits, generation_config)
+    sorted_probs, sorted_idx = torch.sort(torch.softmax(logits, dim=-1), descending=True)
+    return _sample_from_sorted(sorted_probs, sorted_idx, generation_config.top_p)
+
+
+def _sample_to_host(
+    logits: torch.Tensor, generation_config: GenerationConfig
+) -> tuple[torch.Tensor, int]:
+    """
+    Sample the next token and return it both as a device tensor and as a host int.
+
+    The token and the top-p coverage flag come back in a single device sync; only a miss,
+    where the nucleus reaches past the top candidates, costs a second draw and sync.
+    """
+    next_token_id, covered = _sample_next_token(logits, generation_config)
+    if covered is None:
+        return next_token_id, next_token_id.item()
+    token, ok = torch.cat((next_token_id.view(1), covered.view(1).long())).tolist()
+    if not ok:
+        next_token_id = _sample_top_p_sorted(logits, generation_config)
+        token = next_token_id.item()
+    return next_token_id, token
+
+
+class _IncrementalDecoder:
+    """
+    Turns a stream of token ids into text without splitting multi-byte characters.
+
+    Each token is decoded together with the few tokens before it, so byte-level BPE pieces
+    and leading-space markers come out right; text is held back while it still ends in an
+    incomplete character. Fast tokenizers do this in Rust through `DecodeStream`.
+    """
 
     def __init__(self, tokenizer: AutoTokenizer):
-        self.tokenizer = tokenizer
+        self._tokenizer = tokenizer
+        self._ids: list[int] = []
+        self._prefix_offset = 0
+        self._read_offset = 0
+        self._backend = None
+        self._stream = None
+        if DecodeStream is not None and getattr(tokenizer, "is_fast", False):
+            self._backend = tokenizer.backend_tokenizer
+            self._stream = DecodeStream(skip_special_tokens=True)
+
+    def _decode(self, ids: list[int]) -> str:
+        return self._tokenizer.decode(
+            ids, skip_special_tokens=True, clean_up_tokenization_spaces=False
+        )
 
-    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
-        full_text = self.tokenizer.decode(input_ids[0], skip_special_tokens=True)
-        if full_text.rstrip().endswith("</rica>"):
-            return True
-        return False
+    def _pending_text(self) -> str:
+        prefix_text = self._decode(self._ids[self._prefix_offset : self._read_offset])
+        full_text = self._decode(self._ids[self._prefix_offset :])
+        return full_text[len(prefix_text) :]
+
+    def step(self, token: int) -> str:
+        """Add one token and return the text it completes (possibly empty)."""
+        if self._stream is not None:
+            return self._stream.step(self._backend, token) or ""
+
+        self._ids.append(token)
+        new_text = self._pending_text()
+        if not new_text or new_text.endswith("\ufffd"):
+            return ""
+
+        self._prefix_offset = self._read_offset
+        self._read_offset = len(self._ids)
+        # Ids before the prefix window can no longer change how later tokens decode.
+        del self._ids[: self._prefix_offset]
+        self._read_offset -= self._prefix_offset
+        self._prefix_offset = 0
+        return new_text
+
+    def flush(self) -> str:
+        """Return whatever text is still held back and reset the decoder."""
+        if self._stream is not None:
+            # The stream only ever holds back bytes of an unfinished character.
+            self._stream = DecodeStream(skip_special_tokens=True)
+            return ""
+
+        text = self._pending_text()
+        self._ids.clear()
+        self._prefix_offset = 0
+        self._read_offset = 0
+        return text
 
 
 class ReasoningThread(ReasoningThreadBase):
@@ -54,13 +370,51 @@ class ReasoningThread(ReasoningThreadBase):
         generation_config: Optional[Dict[str, Any]] = None,
         model: Optional[AutoModelForCausalLM] = None,
         tokenizer: Optional[AutoTokenizer] = None,
+        static_cache_len: Optional[int] = None,
+        quantization: Literal["none", "int8", "nf4"] = "none",
+        kv_cache_quant: Literal["none", "int2", "int4", "int8"] = "none",
+        streaming_batch_ms: float = 25.0,
+        dtype: Optional[torch.dtype] = None,
+        max_parallel_tools: int = 8,
     ):
-        super().__init__(context)
+        """
+        Args:
+            context: The initial context string.
+            model_name: The Hugging Face model to load when `model`/`tokenizer` are not given.
+            generation_config: Overrides for the default generation parameters. The decode
+                loop applies max_new_tokens, do_sample, temperature, top_k, top_p and
+                eos_token_id; other keys are ignored with a warning.
+            model: An already-loaded model to share with this thread.
+            tokenizer: An already-loaded tokenizer to share with this thread.
+            static_cache_len: If set, decode into a preallocated `StaticCache` of this many
+                tokens with a `torch.compile`d single-token step. Models that cannot be
+                compiled into a full graph keep using the dynamic cache.
+            quantization: Load the weights as bitsandbytes "int8" or "nf4" instead of
+                bf16/fp32. Only used when this thread loads the model itself.
+            kv_cache_quant: Store keys/values in a quantized cache ("int2"/"int4" via quanto,
+                "int8" via HQQ) to cut decode memory traffic. Cannot be combined with
+                `static_cache_len`.
+            streaming_batch_ms: Longest time generated text is held back so it can be passed
+                to @token_generated callbacks in one call. 0 hands off every token's text.
+            dtype: Weight dtype to load. Defaults to bf16 on Ampere-or-newer GPUs and
+                bf16-capable CPUs, fp16 on older GPUs and fp32 on other CPUs. Only used when
+                this thread loads the model itself.
+            max_parallel_tools: How many tool calls from one generation step may run at once.
+        """
+        super().__init__(context, max_parallel_tools)
+        if kv_cache_quant != "none" and static_cache_len is not None:
+            raise ValueError("kv_cache_quant and static_cache_len are mutually exclusive.")
+        if kv_cache_quant != "none" and kv_cache_quant not in _KV_CACHE_QUANT:
+            raise ValueError(f"Unsupported kv_cache_quant '{kv_cache_quant}'.")
+
         self.model_name: str = model_name
         self.model_modal: str = "PyTorch/Transformers"
+        self.quantization: Literal["none", "int8", "nf4"] = quantization
+        self.kv_cache_quant: Literal["none", "int2", "int4", "int8"] = kv_cache_quant
+        self.streaming_batch_ms: float = streaming_batch_ms
+        self.dtype: Optional[torch.dtype] = dtype
 
         self._task: Optional[asyncio.Task] = None
-        self._lock = asyncio.Lock()
         self._prompt_injected = False
 
         self._pause_event = asyncio.Event()
@@ -70,8 +424,41 @@ class ReasoningThread(ReasoningThreadBase):
 
         self._model: Optional[AutoModelForCausalLM] = model
         self._tokenizer: Optional[AutoTokenizer] = tokenizer
-        self._streamer: Optional[TextIteratorStreamer] = None
-        self._stopping_criteria: Optional[StoppingCriteriaList] = None
+
+        # Incremental decoding state. `_past_kv` holds every token the model has seen,
+        # `_current_input_ids` the tokens queued for the next forward pass, and
+        # `_emitted_char_len` how much of `_context` is covered by those two.
+        self._past_kv: Optional[Any] = None
+        self._current_input_ids: Optional[torch.Tensor] = None
+        self._emitted_char_len: int = 0
+        self._decoder: Optional[_IncrementalDecoder] = None
+        # Owned by the thread so cached ids and the tokenizer are freed along with it.
+        self._encode_cache: OrderedDict[tuple[str, bool], tuple[int, ...]] = OrderedDict()
+
+        self._emit_buf: list[str] = []
+        self._emit_buf_len: int = 0
+        self._last_flush: float = 0.0
+
+        # Forward passes run on one dedicated worker so the event loop keeps serving inserts,
+        # callbacks and pause/stop requests while the model computes.
+        self._forward_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="rica-forward",
+            initializer=torch.set_grad_enabled,
+            initargs=(False,),
+        )
+        self._stream: Optional[torch.cuda.Stream] = None
+
+        self._static_cache_len: Optional[int] = static_cache_len
+        self._cache_len: int = 0
+        self._cache_position: Optional[torch.Tensor] = None
+        self._decode_step: Optional[Callable[..., torch.Tensor]] = None
+        self._decode_step_ready: bool = False
+        self._prefill_step: Optional[Callable[..., torch.Tensor]] = None
+        self._logits_to_keep: Optional[str] = None
+        # Multi-token chunks are right-padded to a multiple of this many tokens (1: no padding).
+        self._chunk_pad_multiple: Optional[int] = None
+        self._eos_token_ids: Optional[frozenset[int]] = None
 
         default_config = {
             "max_new_tokens": 1024,
@@ -82,6 +469,11 @@ class ReasoningThread(ReasoningThreadBase):
         if generation_config:
             default_config.update(generation_config)
         self._generation_config = GenerationConfig(**default_config)
+        unsupported = _unsupported_generation_keys(self._generation_config)
+        if unsupported:
+            logger.warning(
+                "Ignoring unsupported generation_config keys: %s", ", ".join(unsupported)
+            )
 
     async def create_sub_thread(
         self, model_name: Optional[str] = None, config: Optional[Dict[str, Any]] = None
@@ -105,6 +497,12 @@ class ReasoningThread(ReasoningThreadBase):
             generation_config=config,
             model=shared_model,
             tokenizer=shared_tokenizer,
+            static_cache_len=self._static_cache_len,
+            quantization=self.quantization,
+            kv_cache_quant=self.kv_cache_quant,
+            streaming_batch_ms=self.streaming_batch_ms,
+            dtype=self.dtype,
+            max_parallel_tools=self._max_parallel_tools,
         )
 
     # --------------------------------------------------------------------------
@@ -123,8 +521,9 @@ class ReasoningThread(ReasoningThreadBase):
         formatted_input = f'<rica-callback package="rica.userinput">{s}</rica-callback>'
 
         self.pause()
-        async with self._lock:
-            self._context += formatted_input
+        # Generated text still waiting in the emit buffer precedes this input in the context.
+        await self._flush_emit_buffer()
+        self._append_context(formatted_input)
         await self._emit_token(formatted_input)
 
         self.run()
@@ -132,15 +531,18 @@ class ReasoningThread(ReasoningThreadBase):
     async def wait(self):
         if self._task and not self._task.done():
             await self._task
+        await self._drain_token_emits(timeout=_SHUTDOWN_TIMEOUT_S)
 
     async def destroy(self):
         if self._task and not self._task.done():
             self._stop_event.set()
             self._pause_event.set()
             try:
-                await asyncio.wait_for(self._task, timeout=5.0)
+                await asyncio.wait_for(self._task, timeout=_SHUTDOWN_TIMEOUT_S)
             except (asyncio.CancelledError, asyncio.TimeoutError):
                 self._task.cancel()
+        await self._drain_token_emits(timeout=_SHUTDOWN_TIMEOUT_S)
+        self._forward_executor.shutdown(wait=False)
 
     def run(self):
         self._pause_event.set()
@@ -156,33 +558,44 @@ class ReasoningThread(ReasoningThreadBase):
     # Internal Helper Methods
     # --------------------------------------------------------------------------
 
-    def _get_next_token_from_streamer(self) -> Optional[str]:
-        """
-        Synchronous helper to safely get the next token from the streamer.
-        It catches StopIteration and returns None, preventing the exception
-        from propagating into the asyncio event loop.
-        """
-        try:
-            return next(self._streamer)
-        except StopIteration:
-            return None
-
     async def _ensure_model(self):
-        if self._model and self._tokenizer:
-            return
+        if not (self._model and self._tokenizer):
+            await self._load_model()
+        self._ensure_decoding_resources()
+        if self._decode_step is not None and not self._decode_step_ready:
+            # Pay for compilation and graph capture now rather than on the first real token.
+            await asyncio.get_running_loop().run_in_executor(
+                self._forward_executor, self._warm_up_decode_step
+            )
 
+    async def _load_model(self):
         def _load_sync():
-            tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-
-            dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
-
-            # 使用 device_map="auto" 直接将模型加载到 GPU，避免 CPU 内存溢出
-            model = AutoModelForCausalLM.from_pretrained(
-                self.model_name,
-                low_cpu_mem_usage=True,
-                device_map="auto",
-                torch_dtype=dtype,
-            )
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name, use_fast=True)
+
+            dtype = self.dtype or _default_dtype()
+            if torch.cuda.is_available():
+                # Covers whatever still runs in fp32, e.g. norms and fp32-loaded models.
+                _enable_tf32()
+
+            candidates = _attn_implementations()
+            for attn_implementation in candidates:
+                try:
+                    # 使用 device_map="auto" 直接将模型加载到 GPU，避免 CPU 内存溢出
+                    model = AutoModelForCausalLM.from_pretrained(
+                        self.model_name,
+                        low_cpu_mem_usage=True,
+                        device_map="auto",
+                        torch_dtype=dtype,
+                        quantization_config=_build_quantization_config(self.quantization, dtype),
+                        attn_implementation=attn_implementation,
+                    )
+                    break
+                except (ImportError, ValueError) as e:
+                    # Only a rejected attention backend is worth retrying with the next one;
+                    # anything else (missing bitsandbytes, a bad dtype, ...) fails them all.
+                    if attn_implementation == candidates[-1] or not _is_attn_backend_error(e):
+                        raise
+            model.config.use_cache = True
 
             if tokenizer.pad_token is None:
                 tokenizer.pad_token = tokenizer.eos_token
@@ -190,79 +603,337 @@ class ReasoningThread(ReasoningThreadBase):
             return model, tokenizer
 
         self._model, self._tokenizer = await asyncio.to_thread(_load_sync)
-        self._streamer = TextIteratorStreamer(
-            self._tokenizer,
-            skip_prompt=True,
-            skip_special_tokens=True,
-            timeout=None,
-        )
-        self._stopping_criteria = StoppingCriteriaList([_ToolCallStoppingCriteria(self._tokenizer)])
         self._model.eval()
 
+    def _ensure_decoding_resources(self):
+        """Set up per-thread decoding state that depends on the loaded model."""
+        if self._stream is None and self._model.device.type == "cuda":
+            self._stream = torch.cuda.Stream(device=self._model.device)
+        if self._logits_to_keep is None:
+            self._logits_to_keep = _logits_to_keep_arg(self._model) or ""
+        if self._chunk_pad_multiple is None:
+            # GEMM kernels take slower tail paths when the chunk length is not a multiple of 8.
+            # The pads are cropped off the cache afterwards, which a quantized cache cannot do.
+            pad = self._model.device.type == "cuda" and self.kv_cache_quant == "none"
+            self._chunk_pad_multiple = 8 if pad else 1
+        if self._eos_token_ids is None:
+            self._eos_token_ids = self._resolve_eos_token_ids()
+        if self.kv_cache_quant != "none" and self._past_kv is None:
+            if QuantizedCache is None:
+                raise AdapterDependenciesImportError(
+                    "kv_cache_quant requires a transformers release that provides QuantizedCache."
+                )
+            backend, nbits = _KV_CACHE_QUANT[self.kv_cache_quant]
+            self._past_kv = QuantizedCache(backend=backend, config=self._model.config, nbits=nbits)
+        self._ensure_static_cache()
+
+    def _resolve_eos_token_ids(self) -> frozenset[int]:
+        """
+        Collect the ids that end generation, as `generate` would: the thread's config, the
+        model's own generation config (chat models list their end-of-turn ids there) and
+        the tokenizer's EOS token.
+        """
+        eos = _as_id_set(self._generation_config.eos_token_id)
+        eos |= _as_id_set(self._tokenizer.eos_token_id)
+        model_config = getattr(self._model, "generation_config", None)
+        if model_config is not None:
+            eos |= _as_id_set(model_config.eos_token_id)
+            unsupported = _unsupported_generation_keys(model_config)
+            if unsupported:
+                logger.warning(
+                    "Ignoring unsupported keys in the model's generation config: %s",
+                    ", ".join(unsupported),
+                )
+        return frozenset(eos)
+
+    def _ensure_static_cache(self):
+        """Allocate the static KV cache and compiled decode step once, if requested."""
+        if self._static_cache_len is None or self._decode_step is not None:
+            return
+
+        model = self._model
+        keep_kwargs = {self._logits_to_keep: 1} if self._logits_to_keep else {}
+        if StaticCache is None:
+            reason = "this transformers release has no StaticCache"
+        elif not getattr(model, "_can_compile_fullgraph", False):
+            reason = f"{type(model).__name__} cannot be compiled as a full graph"
+        else:
+            reason = None
+        if reason is not None:
+            logger.warning("Ignoring static_cache_len, using the dynamic cache: %s", reason)
+            self._static_cache_len = None
+            return
+
+        cache = StaticCache(config=model.config, max_cache_len=self._static_cache_len)
+        self._past_kv = cache
+        self._cache_position = torch.arange(self._static_cache_len, device=model.device)
+
+        def _step(input_ids: torch.Tensor, cache_position: torch.Tensor) -> torch.Tensor:
+            outputs = model(
+                input_ids=input_ids,
+                past_key_values=cache,
+                cache_position=cache_position,
+                use_cache=True,
+                **keep_kwargs,
+            )
+            return outputs.logits[:, -1, :]
+
+        # Only the single-token step has a stable shape worth capturing; multi-token
+        # chunks (prompt, inserts, tool results) run eagerly against the same cache.
+        # bitsandbytes layers take data-dependent paths that break full-graph capture.
+        fullgraph = getattr(model, "hf_quantizer", None) is None
+        self._prefill_step = _step
+        self._decode_step = torch.compile(_step, mode="reduce-overhead", fullgraph=fullgraph)
+
+    def _warm_up_decode_step(self):
+        """Run the compiled decode step until it is compiled and its CUDA graph recorded."""
+        token = torch.zeros((1, 1), dtype=torch.long, device=self._model.device)
+        with torch.inference_mode(), self._stream_context():
+            # "reduce-overhead" records the graph on the third call with the same shapes.
+            for _ in range(3):
+                self._decode_step(token, self._cache_position[:1])
+            # The cache is still empty at this point; zeroing it in place keeps the tensor
+            # addresses the recorded graph refers to.
+            self._past_kv.reset()
+        self._decode_step_ready = True
+
+    def _stream_context(self):
+        """Enter the side CUDA stream, ordered after work queued on the default stream."""
+        if self._stream is None:
+            return contextlib.nullcontext()
+        self._stream.wait_stream(torch.cuda.default_stream(self._stream.device))
+        return torch.cuda.stream(self._stream)
+
+    def _step(self, input_ids: torch.Tensor) -> tuple[torch.Tensor, int]:
+        """
+        Run one forward pass and sample the next token. Executed on the forward worker;
+        returns the token both as a device tensor and as a host int.
+        """
+        with torch.inference_mode(), self._stream_context():
+            logits = self._forward(input_ids)
+            # The id is needed on the host to decode its text anyway, so pay for one device
+            # sync per step and reuse it for the EOS check.
+            return _sample_to_host(logits, self._generation_config)
+
+    def _forward(self, input_ids: torch.Tensor) -> torch.Tensor:
+        """Feed `input_ids` through the model and return the logits at the last position."""
+        while input_ids.shape[1] > _PREFILL_CHUNK_TOKENS:
+            self._forward_chunk(input_ids[:, :_PREFILL_CHUNK_TOKENS])
+            input_ids = input_ids[:, _PREFILL_CHUNK_TOKENS:]
+        return self._forward_chunk(input_ids)
+
+    def _forward_chunk(self, input_ids: torch.Tensor) -> torch.Tensor:
+        """Run a single forward pass over `input_ids`, extending the KV cache."""
+        if self._decode_step is None:
+            return self._forward_dynamic(input_ids)
+
+        start = self._cache_len
+        end = start + input_ids.shape[1]
+        if end > self._static_cache_len:
+            raise RuntimeError(
+                f"Static KV cache is full ({self._static_cache_len} tokens); "
+                "increase static_cache_len."
+            )
+        step = self._decode_step if input_ids.shape[1] == 1 else self._prefill_step
+        logits = step(input_ids, self._cache_position[start:end])
+        self._cache_len = end
+        return logits
+
+    def _forward_dynamic(self, input_ids: torch.Tensor) -> torch.Tensor:
+        """Forward pass against the dynamic cache, padding multi-token chunks on CUDA."""
+        n = input_ids.shape[1]
+        if n > 1 and self._chunk_pad_multiple > 1:
+            input_ids = _pad_to_multiple(
+                input_ids, self._chunk_pad_multiple, self._tokenizer.pad_token_id
+            )
+        padded = input_ids.shape[1] != n
+
+        # Only the last real position is sampled from, so skip the LM head everywhere else.
+        kwargs = {}
+        last = n - 1
+        if not padded and self._logits_to_keep:
+            kwargs[self._logits_to_keep] = 1
+            last = -1
+        elif self._logits_to_keep == "logits_to_keep":
+            kwargs["logits_to_keep"] = torch.tensor([n - 1], device=input_ids.device)
+            last = -1
+
+        outputs = self._model(
+            input_ids=input_ids, past_key_values=self._past_kv, use_cache=True, **kwargs
+        )
+        self._past_kv = outputs.past_key_values
+        self._cache_len += n
+        if padded:
+            # The pads come after every real token, so causal attention kept them out of the
+            # real positions; cropping them leaves the cache exactly as if it were unpadded.
+            self._past_kv.crop(self._cache_len)
+        return outputs.logits[:, last, :]
+
+    async def _flush_emit_buffer(self):
+        """Hand buffered generated text to the @token_generated callbacks in one call."""
+        if not self._emit_buf:
+            return
+        text = "".join(self._emit_buf)
+        self._emit_buf.clear()
+        self._emit_buf_len = 0
+        self._last_flush = time.monotonic()
+        await self._emit_token(text)
+
     async def _inject_prompt_if_needed(self):
         if self._prompt_injected:
             return
 
-        async with self._lock:
-            async with self._apps_lock:
-                system_prompt = await _rica_prompt(self._apps, self.model_name, self.model_modal)
-            self._context = system_prompt + self._context
-            self._last_processed_index += len(system_prompt)
-            self._prompt_injected = True
+        # `_apps` is an immutable snapshot, so the prompt needs no lock. Re-check after the
+        # await in case a concurrent caller injected it meanwhile.
+        system_prompt = await _rica_prompt(self._apps, self.model_name, self.model_modal)
+        if self._prompt_injected:
+            return
+        self._context = system_prompt + self._context
+        self._last_processed_index += len(system_prompt)
+        self._prompt_injected = True
+
+    def _cached_encode(self, text: str, add_special_tokens: bool) -> tuple[int, ...]:
+        """Memoized `tokenizer.encode` for short, frequently repeated strings."""
+        key = (text, add_special_tokens)
+        cache = self._encode_cache
+        ids = cache.get(key)
+        if ids is not None:
+            cache.move_to_end(key)
+            return ids
+        ids = tuple(self._tokenizer.encode(text, add_special_tokens=add_special_tokens))
+        cache[key] = ids
+        if len(cache) > _ENCODE_CACHE_SIZE:
+            cache.popitem(last=False)
+        return ids
+
+    async def _queue_context_delta(self):
+        """
+        Tokenize the part of the context the model has not seen yet and queue it for the
+        next forward pass. Everything before it is already represented in `_past_kv`.
+        """
+        if self._context_len == self._emitted_char_len:
+            return
+        # Capture the end before any await so text appended meanwhile stays pending.
+        end = self._context_len
+        delta = self._context_since(self._emitted_char_len)
+
+        add_special_tokens = self._emitted_char_len == 0
+        if len(delta) <= _CACHED_ENCODE_CHARS:
+            ids = self._cached_encode(delta, add_special_tokens)
+            delta_ids = torch.tensor([ids], dtype=torch.long)
+        else:
+            encode = functools.partial(
+                self._tokenizer.encode,
+                delta,
+                add_special_tokens=add_special_tokens,
+                return_tensors="pt",
+            )
+            if len(delta) > _OFFLOAD_ENCODE_CHARS:
+                delta_ids = await asyncio.to_thread(encode)
+            else:
+                delta_ids = encode()
+        device = self._model.device
+        if device.type == "cuda":
+            # Stage through page-locked memory so the copy is queued asynchronously on the
+            # default stream; `_stream_context` orders the forward pass after it.
+            delta_ids = delta_ids.pin_memory().to(device, non_blocking=True)
+        else:
+            delta_ids = delta_ids.to(device)
+        self._emitted_char_len = end
+
+        if self._current_input_ids is None:
+            self._current_input_ids = delta_ids
+        else:
+            self._current_input_ids = torch.cat([self._current_input_ids, delta_ids], dim=1)
 
     async def _run_loop(self):
         try:
             await self._ensure_model()
 
-            while not self._stop_event.is_set():
-                await self._pause_event.wait()
-                if self._stop_event.is_set():
+            tokenizer = self._tokenizer
+            if self._decoder is None:
+                self._decoder = _IncrementalDecoder(tokenizer)
+            decoder = self._decoder
+            eos_token_ids = self._eos_token_ids
+            max_new_tokens = self._generation_config.max_new_tokens
+            loop = asyncio.get_running_loop()
+
+            # Bind per-token lookups once; with small models the Python side of each step is
+            # a noticeable share of the per-token latency.
+            stop_event = self._stop_event
+            pause_event = self._pause_event
+            run_in_executor = loop.run_in_executor
+            executor = self._forward_executor
+            step = self._step
+            queue_context_delta = self._queue_context_delta
+            append_context = self._append_context
+            context_since = self._context_since
+            emit_buf = self._emit_buf
+            flush_emit_buffer = self._flush_emit_buffer
+            monotonic = time.monotonic
+            batch_seconds = self.streaming_batch_ms / 1000
+
+            while not stop_event.is_set():
+                await pause_event.wait()
+                if stop_event.is_set():
                     break
 
                 await self._inject_prompt_if_needed()
 
-                async with self._lock:
-                    inputs = self._tokenizer(self._context, return_tensors="pt").to(
-                        self._model.device
-                    )
-
-                generation_kwargs = {
-                    "input_ids": inputs["input_ids"],
-                    "attention_mask": inputs["attention_mask"],
-                    "generation_config": self._generation_config,
-                    "streamer": self._streamer,
-                    "stopping_criteria": self._stopping_criteria,
-                }
-
-                async def _read_from_streamer():
-                    """Read tokens from streamer and emit them."""
-                    while True:
-                        try:
-                            new_text = await asyncio.to_thread(self._get_next_token_from_streamer)
-
-                            if new_text is None:
-                                break
-
-                            if self._stop_event.is_set() or not self._pause_event.is_set():
-                                break
-
-                            async with self._lock:
-                                self._context += new_text
-                            await self._emit_token(new_text)
-
-                        except StopIteration:
+                for _ in range(max_new_tokens):
+                    if stop_event.is_set() or not pause_event.is_set():
+                        break
+
+                    await queue_context_delta()
+                    current_input_ids = self._current_input_ids
+                    if current_input_ids is None or current_input_ids.shape[1] == 0:
+                        break
+
+                    fed_len = self._emitted_char_len
+                    next_token_id, token = await run_in_executor(executor, step, current_input_ids)
+                    self._current_input_ids = None
+
+                    if self._context_len != fed_len:
+                        # Text was inserted while the step ran. The sampled token did not see
+                        # it, so drop the token and feed the inserted text next instead.
+                        continue
+
+                    is_eos = token in eos_token_ids
+                    if is_eos:
+                        new_text = decoder.flush()
+                    else:
+                        # The sampled token is fed on the next step; its text becomes part of
+                        # the context here, so it must not be re-encoded as a delta.
+                        self._current_input_ids = next_token_id
+                        new_text = decoder.step(token)
+
+                    if new_text:
+                        append_context(new_text)
+                        self._emitted_char_len += len(new_text)
+                        emit_buf.append(new_text)
+                        self._emit_buf_len += len(new_text)
+                        if (
+                            self._emit_buf_len >= _EMIT_BATCH_CHARS
+                            or monotonic() - self._last_flush >= batch_seconds
+                        ):
+                            await flush_emit_buffer()
+
+                    if is_eos:
+                        break
+                    # A closing tag can only have just completed if this token produced its
+                    # final ">"; skip slicing the context tail for every other token.
+                    if ">" in new_text:
+                        tail = context_since(self._context_len - 16)
+                        if tail.rstrip().endswith("</rica>"):
                             break
 
-                generation_task = asyncio.to_thread(self._model.generate, **generation_kwargs)
-                reader_task = asyncio.create_task(_read_from_streamer())
-
-                await asyncio.gather(generation_task, reader_task, return_exceptions=True)
-
+                await flush_emit_buffer()
                 was_executed, _ = await self._detect_and_execute_tool_tail()
-                if not was_executed:
+                if not was_executed and self._context_len == self._emitted_char_len:
                     self.pause()
 
         except Exception as e:
+            await self._flush_emit_buffer()
             error_msg = f"[adapter-error]{type(e).__name__}: {e}"
             await self._emit_token(error_msg)
             if not isinstance(e, asyncio.CancelledError):
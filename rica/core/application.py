@@ -9,7 +9,7 @@ provided functions are wrapped into async callables when registered.
 import asyncio
 import functools
 from dataclasses import dataclass
-from typing import Any, Callable, Coroutine, List, Optional, Union
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
 from uuid import UUID
 
 from ..exceptions import PackageInvalidError, RouteExistError
@@ -50,13 +50,27 @@ class Route:
         function: The callable function associated with the route.
         background: A boolean indicating if the tool should run in the background.
         timeout: The timeout for the tool in milliseconds.
+        blocking: Whether a synchronous `function` may block and so runs in a worker thread.
+        package: The package name of the application the route belongs to.
+        is_coroutine: Whether `function` is a coroutine function, resolved once at registration.
     """
 
-    def __init__(self, route: str, function: Callable[..., Any], background: bool, timeout: int):
+    def __init__(
+        self,
+        route: str,
+        function: Callable[..., Any],
+        background: bool,
+        timeout: int,
+        blocking: bool = True,
+        package: str = "",
+    ):
         self.route: str = route
         self.function: Callable[..., Any] = function
         self.background: bool = background
         self.timeout: int = timeout
+        self.blocking: bool = blocking
+        self.package: str = package
+        self.is_coroutine: bool = asyncio.iscoroutinefunction(function)
 
 
 @dataclass
@@ -102,26 +116,27 @@ class RiCA:
         self.package: str = package
         self.description: str = description
         self.routes: List[Route] = []
+        # Lookup index over `routes`; the list keeps registration order for the prompt.
+        self._route_index: Dict[str, Route] = {}
 
     def find_route(self, route_path: str) -> Optional[Route]:
         """Finds a registered application endpoint by its route path."""
-        for route in self.routes:
-            if route.route == route_path:
-                return route
-        return None
+        return self._route_index.get(route_path)
 
     def route(
-        self, route_path: str, background: bool = True, timeout: int = -1
+        self, route_path: str, background: bool = True, timeout: int = -1, blocking: bool = True
     ) -> Callable[[Callable[..., Any]], Callable[..., Coroutine[Any, Any, Any]]]:
         """
         Register a new endpoint (route) dynamically.
 
-        Non-async functions are wrapped with `asyncio.to_thread` so they behave as async callables.
+        Non-async functions are wrapped with `asyncio.to_thread` so they behave as async callables,
+        unless `blocking` is False, in which case they are called directly on the event loop.
 
         Args:
             route_path: The path for the new endpoint.
             background: Whether the function should run in the background.
             timeout: The timeout for the function in milliseconds.
+            blocking: Set to False for cheap synchronous functions to skip the thread hand-off.
 
         Returns:
             A decorator that registers the function as a route.
@@ -132,14 +147,23 @@ class RiCA:
             )
 
         def decorator(function: Callable[..., Any]) -> Callable[..., Coroutine[Any, Any, Any]]:
-            self.routes.append(Route(route_path, function, background, timeout))
+            route = Route(route_path, function, background, timeout, blocking, self.package)
+            self.routes.append(route)
+            self._route_index[route_path] = route
 
-            if asyncio.iscoroutinefunction(function):
+            if route.is_coroutine:
 
                 @functools.wraps(function)
                 async def wrapper(*args, **kwargs):
                     return await function(*args, **kwargs)
 
+                return wrapper
+            elif not blocking:
+
+                @functools.wraps(function)
+                async def wrapper(*args, **kwargs):
+                    return function(*args, **kwargs)
+
                 return wrapper
             else:
 
@@ -63,7 +63,7 @@ class ThreadManager:
 
             return {"status": "success", "thread_id": thread_id, "message": "Thread spawned"}
         except Exception as e:
-            logger.error(f"Failed to spawn thread: {e}", exc_info=True)
+            logger.error("Failed to spawn thread: %s", e, exc_info=True)
             return {"error": f"Failed to spawn thread: {str(e)}"}
 
     async def kill(self, input_data: dict) -> dict:
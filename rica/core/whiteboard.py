@@ -1,5 +1,5 @@
 import logging
-from typing import Dict
+from typing import Dict, List
 
 logger = logging.getLogger(__name__)
 
@@ -10,7 +10,9 @@ class Whiteboard:
     """
 
     def __init__(self):
-        self._content: Dict[str, str] = {}
+        # Content is kept as chunks so appends do not copy the whole board; reads join
+        # them and keep the joined string as the only chunk.
+        self._content: Dict[str, List[str]] = {}
         self._descriptions: Dict[str, str] = {}
 
     def handle(self, input_data: dict) -> dict:
@@ -35,19 +37,18 @@ class Whiteboard:
 
         if action == "read":
             return {
-                "content": self._content.get(wb_id, ""),
+                "content": self._read(wb_id),
                 "description": self._descriptions.get(wb_id, ""),
             }
 
         elif action == "write":
-            self._content[wb_id] = content
+            self._content[wb_id] = [content]
             if description is not None:
                 self._descriptions[wb_id] = description
             return {"status": "success", "message": f"Whiteboard '{wb_id}' updated"}
 
         elif action == "append":
-            current = self._content.get(wb_id, "")
-            self._content[wb_id] = current + "\n" + content
+            self._content.setdefault(wb_id, []).append("\n" + content)
             if description is not None:
                 self._descriptions[wb_id] = description
             return {"status": "success", "message": f"Appended to whiteboard '{wb_id}'"}
@@ -68,6 +69,15 @@ class Whiteboard:
         else:
             return {"error": f"Unknown action: {action}"}
 
+    def _read(self, wb_id: str) -> str:
+        """Return a whiteboard's content, collapsing its chunks into one string."""
+        chunks = self._content.get(wb_id)
+        if not chunks:
+            return ""
+        if len(chunks) > 1:
+            chunks[:] = ["".join(chunks)]
+        return chunks[0]
+
 
 # Singleton instance
 _whiteboard_instance = Whiteboard()
@@ -8,6 +8,11 @@ from rica.exceptions import InvalidRiCAString
 
 logger = logging.getLogger(__name__)
 
+# Fallback patterns for tags that are not well-formed XML.
+_PACKAGE_ATTR_RE = re.compile(r'package=["\']([^"\']+)["\']')
+_ROUTE_ATTR_RE = re.compile(r'route=["\']([^"\']+)["\']')
+_CONTENT_RE = re.compile(r">\s*(.*?)\s*<\/rica>", re.DOTALL)
+
 
 def parse_rica_tag(tag_text: str) -> Tuple[str, str, Any]:
     """
@@ -28,15 +33,15 @@ def parse_rica_tag(tag_text: str) -> Tuple[str, str, Any]:
         try:
             root = ET.fromstring(tag_text)
         except ET.ParseError as e:
-            logger.error(f"XML parse error: {e}, tag_text: {tag_text[:200]}")
+            logger.error("XML parse error: %s, tag_text: %s", e, tag_text[:200])
             # Fallback regex
-            package_match = re.search(r'package=["\']([^"\']+)["\']', tag_text)
-            route_match = re.search(r'route=["\']([^"\']+)["\']', tag_text)
+            package_match = _PACKAGE_ATTR_RE.search(tag_text)
+            route_match = _ROUTE_ATTR_RE.search(tag_text)
 
             if package_match and route_match:
                 package_name = package_match.group(1)
                 route_name = route_match.group(1)
-                content_match = re.search(r">\s*(.*?)\s*<\/rica>", tag_text, re.DOTALL)
+                content_match = _CONTENT_RE.search(tag_text)
                 content_str = content_match.group(1) if content_match else ""
 
                 class MockRoot:
@@ -0,0 +1,407 @@
+import asyncio
+import threading
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers  # noqa: E402
+from transformers import (  # noqa: E402
+    GenerationConfig,
+    LlamaConfig,
+    LlamaForCausalLM,
+    PreTrainedTokenizerFast,
+)
+
+from rica.adapters import transformers_adapter as adapter  # noqa: E402
+from rica.adapters.transformers_adapter import (  # noqa: E402
+    ReasoningThread,
+    _sample_next_token,
+    _sample_to_host,
+)
+
+USER_INPUT = '<rica-callback package="rica.userinput">USER</rica-callback>'
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    tok = Tokenizer(models.BPE())
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=320,
+        special_tokens=["<eos>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    )
+    tok.train_from_iterator(['<rica package="rica" route="/response"> hello world'] * 20, trainer)
+    return PreTrainedTokenizerFast(tokenizer_object=tok, eos_token="<eos>", pad_token="<eos>")
+
+
+@pytest.fixture(scope="module")
+def model(tokenizer):
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        num_key_value_heads=2,
+        max_position_embeddings=4096,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    return LlamaForCausalLM(config).eval()
+
+
+def _make_thread(model, tokenizer, **generation_config):
+    config = {"max_new_tokens": 8, "do_sample": False}
+    config.update(generation_config)
+    return ReasoningThread(
+        model_name="tiny-llama", model=model, tokenizer=tokenizer, generation_config=config
+    )
+
+
+def _record_steps(thread, before_step=None):
+    """Wrap the forward step; return the ids fed at each step and the tokens it sampled."""
+    fed, sampled = [], []
+    original = thread._step
+
+    def step(input_ids):
+        if before_step is not None:
+            before_step(len(sampled))
+        fed.append(input_ids[0].tolist())
+        next_token_id, token = original(input_ids)
+        sampled.append(token)
+        return next_token_id, token
+
+    thread._step = step
+    return fed, sampled
+
+
+async def _wait_idle(thread, timeout=10.0):
+    """Wait until the decode loop has paused itself (or died)."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while thread._pause_event.is_set() and not thread._task.done():
+        assert asyncio.get_running_loop().time() < deadline, "decode loop did not go idle"
+        await asyncio.sleep(0.01)
+    if thread._task.done():
+        thread._task.result()
+
+
+@pytest.mark.asyncio
+async def test_insert_during_step_is_fed_to_model(model, tokenizer):
+    thread = _make_thread(model, tokenizer)
+    entered = threading.Event()
+    release = threading.Event()
+
+    def before_step(index):
+        if index == 1:
+            entered.set()
+            release.wait(timeout=10)
+
+    fed, _ = _record_steps(thread, before_step)
+    try:
+        await thread.insert("hi")
+        assert await asyncio.to_thread(entered.wait, 10)
+        # The second step is still running on the forward worker.
+        await thread.insert("USER")
+        release.set()
+        await _wait_idle(thread)
+
+        fed_text = tokenizer.decode(sum(fed, []))
+        assert USER_INPUT in thread.context
+        assert USER_INPUT in fed_text
+        assert thread.context.startswith(fed_text)
+    finally:
+        release.set()
+        await thread.destroy()
+
+
+async def _first_greedy_token(model, tokenizer):
+    thread = _make_thread(model, tokenizer, max_new_tokens=1)
+    _, sampled = _record_steps(thread)
+    try:
+        await thread.insert("hi")
+        await _wait_idle(thread)
+    finally:
+        await thread.destroy()
+    return sampled[0]
+
+
+@pytest.mark.asyncio
+async def test_stops_on_any_configured_eos_id(model, tokenizer):
+    first = await _first_greedy_token(model, tokenizer)
+
+    thread = _make_thread(model, tokenizer, eos_token_id=[tokenizer.eos_token_id, first])
+    _, sampled = _record_steps(thread)
+    try:
+        await thread.insert("hi")
+        await _wait_idle(thread)
+    finally:
+        await thread.destroy()
+
+    assert sampled == [first]
+    assert thread.context.endswith('<rica-callback package="rica.userinput">hi</rica-callback>')
+
+
+@pytest.mark.asyncio
+async def test_stops_on_model_generation_config_eos(model, tokenizer, monkeypatch):
+    first = await _first_greedy_token(model, tokenizer)
+    monkeypatch.setattr(model.generation_config, "eos_token_id", [tokenizer.eos_token_id, first])
+
+    thread = _make_thread(model, tokenizer)
+    _, sampled = _record_steps(thread)
+    try:
+        await thread.insert("hi")
+        await _wait_idle(thread)
+    finally:
+        await thread.destroy()
+
+    assert sampled == [first]
+
+
+def test_warns_on_unsupported_generation_keys(model, tokenizer, caplog):
+    with caplog.at_level("WARNING", logger="rica.adapters.transformers_adapter"):
+        _make_thread(model, tokenizer, repetition_penalty=1.2, top_k=5)
+    messages = [
+        r.getMessage() for r in caplog.records if r.name == "rica.adapters.transformers_adapter"
+    ]
+    assert len(messages) == 1
+    assert "repetition_penalty" in messages[0]
+    assert "top_k" not in messages[0]
+
+
+@pytest.mark.parametrize("missing", ["StaticCache", "fullgraph"])
+def test_warns_when_static_cache_falls_back(model, tokenizer, caplog, monkeypatch, missing):
+    if missing == "StaticCache":
+        monkeypatch.setattr(adapter, "StaticCache", None)
+    else:
+        monkeypatch.setattr(type(model), "_can_compile_fullgraph", False, raising=False)
+    thread = ReasoningThread(
+        model_name="tiny-llama", model=model, tokenizer=tokenizer, static_cache_len=64
+    )
+    with caplog.at_level("WARNING", logger="rica.adapters.transformers_adapter"):
+        thread._ensure_static_cache()
+    messages = [
+        r.getMessage() for r in caplog.records if r.name == "rica.adapters.transformers_adapter"
+    ]
+    assert thread._static_cache_len is None
+    assert len(messages) == 1
+    assert ("StaticCache" if missing == "StaticCache" else "LlamaForCausalLM") in messages[0]
+
+
+def _greedy_reference(model, tokenizer, ids, max_new_tokens):
+    """Tokens `model.generate` picks greedily after `ids`."""
+    output = model.generate(
+        torch.tensor([ids]),
+        attention_mask=torch.ones((1, len(ids)), dtype=torch.long),
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    return output[0, len(ids) :].tolist()
+
+
+async def _run_turns(thread, *inputs):
+    fed, sampled = _record_steps(thread)
+    try:
+        for text in inputs:
+            await thread.insert(text)
+            await _wait_idle(thread)
+    finally:
+        await thread.destroy()
+    return fed, sampled
+
+
+@pytest.mark.asyncio
+async def test_greedy_matches_generate(model, tokenizer):
+    thread = _make_thread(model, tokenizer, max_new_tokens=12)
+    fed, sampled = await _run_turns(thread, "hello world")
+
+    assert len(sampled) == 12
+    assert sampled == _greedy_reference(model, tokenizer, fed[0], 12)
+    # Every sampled token but the last is fed back on its own.
+    assert fed[1:] == [[token] for token in sampled[:-1]]
+
+
+@pytest.mark.asyncio
+async def test_insert_between_turns_extends_cache(model, tokenizer):
+    thread = _make_thread(model, tokenizer, max_new_tokens=6)
+    fed, sampled = await _run_turns(thread, "hello", "world")
+
+    assert len(sampled) == 12
+    # The second turn feeds the last token of the first turn together with the insert.
+    assert fed[6][0] == sampled[5]
+    assert tokenizer.decode(fed[6][1:]) == (
+        '<rica-callback package="rica.userinput">world</rica-callback>'
+    )
+    history = sum(fed[:7], [])
+    assert sampled[6:] == _greedy_reference(model, tokenizer, history, 6)
+
+
+@pytest.mark.asyncio
+async def test_padded_chunks_match_full_forward(model, tokenizer):
+    thread = _make_thread(model, tokenizer)
+    thread._chunk_pad_multiple = 8
+    await thread._ensure_model()
+    lengths = []
+
+    def record_length(module, args, kwargs):
+        if kwargs.get("past_key_values") is thread._past_kv:
+            lengths.append(kwargs["input_ids"].shape[1])
+
+    hook = model.register_forward_pre_hook(record_length, with_kwargs=True)
+    seen = []
+    try:
+        with torch.no_grad():
+            # 13 and 5 tokens both get padded; the single tokens in between do not.
+            for chunk in (list(range(5, 18)), [20], list(range(30, 35)), [40]):
+                seen += chunk
+                logits = thread._forward(torch.tensor([chunk]))
+                expected = model(torch.tensor([seen])).logits[:, -1, :]
+                torch.testing.assert_close(logits, expected, rtol=1e-4, atol=1e-4)
+                # The pads never stay in the cache.
+                assert thread._past_kv.get_seq_length() == len(seen)
+    finally:
+        hook.remove()
+        await thread.destroy()
+
+    assert lengths == [16, 1, 8, 1]
+
+
+def _sample_counts(logits, samples=2000, **config):
+    generation_config = GenerationConfig(do_sample=True, temperature=1.0, **config)
+    torch.manual_seed(0)
+    tokens = torch.cat([_sample_to_host(logits, generation_config)[0] for _ in range(samples)])
+    return torch.bincount(tokens.flatten(), minlength=logits.shape[-1])
+
+
+def test_sampler_top_k_keeps_only_top_candidates():
+    logits = torch.log(torch.tensor([[0.05, 0.5, 0.15, 0.3]]))
+    counts = _sample_counts(logits, top_k=2)
+
+    assert counts[0] == 0 and counts[2] == 0
+    # 0.5 : 0.3 renormalized is 0.625 : 0.375.
+    assert abs(counts[1].item() / counts.sum().item() - 0.625) < 0.05
+
+
+@pytest.mark.parametrize("vocab_size", [4, 100])
+def test_sampler_top_p_keeps_smallest_nucleus(vocab_size):
+    # Above _TOP_P_CANDIDATES tokens the nucleus is looked for among the top candidates only.
+    probs = torch.full((1, vocab_size), 0.05 / (vocab_size - 3))
+    probs[0, :3] = torch.tensor([0.15, 0.5, 0.3])
+    counts = _sample_counts(torch.log(probs), top_p=0.7)
+
+    assert counts[1] > 0 and counts[2] > 0
+    assert counts[0] == 0
+    assert counts[3:].sum() == 0
+
+
+def test_greedy_sampler_takes_argmax():
+    logits = torch.tensor([[0.1, 2.0, 1.9, -1.0]])
+    assert _sample_to_host(logits, GenerationConfig(do_sample=False))[1] == 1
+
+
+def _patch_from_pretrained(monkeypatch, tokenizer, model, errors):
+    """Make model loading raise `errors[attn_implementation]` or return `model`."""
+    calls = []
+
+    def from_pretrained(name, **kwargs):
+        calls.append(kwargs["attn_implementation"])
+        error = errors.get(kwargs["attn_implementation"])
+        if error is not None:
+            raise error
+        return model
+
+    monkeypatch.setattr(adapter.AutoTokenizer, "from_pretrained", lambda *a, **k: tokenizer)
+    monkeypatch.setattr(adapter.AutoModelForCausalLM, "from_pretrained", from_pretrained)
+    monkeypatch.setattr(adapter, "is_flash_attn_2_available", lambda: False)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_load_falls_back_when_attention_backend_is_rejected(model, tokenizer, monkeypatch):
+    error = ValueError("LlamaForCausalLM does not support an attention implementation through sdpa")
+    calls = _patch_from_pretrained(monkeypatch, tokenizer, model, {"sdpa": error})
+
+    thread = ReasoningThread(model_name="tiny-llama")
+    await thread._load_model()
+
+    assert calls == ["sdpa", "eager"]
+    assert thread._model is model
+
+
+@pytest.mark.asyncio
+async def test_load_does_not_retry_other_errors(model, tokenizer, monkeypatch):
+    error = ImportError("Using `bitsandbytes` 4-bit quantization requires bitsandbytes")
+    calls = _patch_from_pretrained(monkeypatch, tokenizer, model, {"sdpa": error})
+
+    thread = ReasoningThread(model_name="tiny-llama")
+    with pytest.raises(ImportError, match="bitsandbytes"):
+        await thread._load_model()
+
+    assert calls == ["sdpa"]
+
+
+@pytest.mark.asyncio
+async def test_sub_thread_keeps_max_parallel_tools(model, tokenizer):
+    thread = ReasoningThread(
+        model_name="tiny-llama", model=model, tokenizer=tokenizer, max_parallel_tools=2
+    )
+    sub_thread = await thread.create_sub_thread()
+    try:
+        assert thread._max_parallel_tools == 2
+        assert sub_thread._max_parallel_tools == 2
+        assert sub_thread._model is model
+    finally:
+        await sub_thread.destroy()
+        await thread.destroy()
+
+
+def test_encode_cache_is_per_thread_and_bounded(model, tokenizer):
+    thread = _make_thread(model, tokenizer)
+    other = _make_thread(model, tokenizer)
+
+    assert thread._cached_encode("hello", False) == tuple(tokenizer.encode("hello"))
+    for i in range(adapter._ENCODE_CACHE_SIZE):
+        thread._cached_encode(str(i), False)
+
+    assert len(thread._encode_cache) == adapter._ENCODE_CACHE_SIZE
+    assert ("hello", False) not in thread._encode_cache
+    assert not other._encode_cache
+
+
+def test_sampler_top_p_falls_back_when_candidates_miss_the_nucleus():
+    # A flat distribution over 200 tokens: the top 64 hold far less than top_p of the mass.
+    logits = torch.zeros((1, 200))
+    generation_config = GenerationConfig(do_sample=True, temperature=1.0, top_p=0.9)
+    _, covered = _sample_next_token(logits, generation_config)
+    assert not covered.item()
+
+    counts = _sample_counts(logits, top_p=0.9)
+    assert (counts > 0).sum() > 64
+
+
+@pytest.mark.parametrize("dtype", [torch.float16, torch.bfloat16])
+def test_nf4_computes_in_the_load_dtype(dtype):
+    config = adapter._build_quantization_config("nf4", dtype)
+    assert config.bnb_4bit_compute_dtype == dtype
+    assert adapter._build_quantization_config("none", dtype) is None
+
+
+@pytest.mark.asyncio
+async def test_destroy_is_not_blocked_by_hung_token_callback(model, tokenizer, monkeypatch):
+    monkeypatch.setattr(adapter, "_SHUTDOWN_TIMEOUT_S", 0.1)
+    thread = _make_thread(model, tokenizer)
+    never = asyncio.Event()
+
+    @thread.token_generated
+    async def hung(piece):
+        await never.wait()
+
+    await thread.insert("hi")
+    await _wait_idle(thread)
+    await asyncio.wait_for(thread.destroy(), timeout=5)
@@ -46,3 +46,14 @@ def test_duplicate_route_registration():
         @app.route("/duplicate")
         def second_function():
             pass
+
+
+def test_route_records_package():
+    """Test that routes know the package they were registered under."""
+    app = RiCA("test.package")
+
+    @app.route("/tool")
+    def tool():
+        pass
+
+    assert app.find_route("/tool").package == "test.package"
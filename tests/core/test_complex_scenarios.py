@@ -62,8 +62,8 @@ async def test_parallel_tool_execution():
     executed, result = await thread._detect_and_execute_tool_tail()
 
     assert executed
-    assert '{"result": "A"}' in result
-    assert '{"result": "B"}' in result
+    assert '{"result":"A"}' in result
+    assert '{"result":"B"}' in result
     assert result.count('{"result"') == 2
 
 
@@ -1,3 +1,5 @@
+import asyncio
+import threading
 from unittest.mock import MagicMock
 
 import pytest
@@ -47,7 +49,7 @@ async def test_callbacks():
     trigger_mock = MagicMock()
     thread.trigger(trigger_mock)
 
-    await thread._emit_token("token")
+    await thread._emit_token("token", ordered=True)
     token_mock.assert_called_with("token")
 
     await thread._emit_response({"result": "ok"})
@@ -72,7 +74,7 @@ async def test_xml_parsing_robustness():
     thread._context = '<rica package="test.pkg" route="/echo">{"msg": "hello"}</rica>'
     executed, result = await thread._detect_and_execute_tool_tail()
     assert executed
-    assert '{"msg": "hello"}' in result
+    assert '{"msg":"hello"}' in result
 
     # Test malformed XML that regex should recover
     # Missing quotes around attributes, slightly broken tag
@@ -81,7 +83,7 @@ async def test_xml_parsing_robustness():
     thread._last_processed_index = 0
     executed, result = await thread._detect_and_execute_tool_tail()
     assert executed
-    assert '{"msg": "recovered"}' in result
+    assert '{"msg":"recovered"}' in result
 
     # Test completely invalid XML
     thread._context = "<rica broken>...</rica>"
@@ -90,3 +92,199 @@ async def test_xml_parsing_robustness():
     # Should return True (detected) but result contains error message
     assert executed
     assert "[tool-error]" in result or "InvalidRiCAString" in result
+
+
+def test_context_chunks():
+    thread = ConcreteReasoningThread("abc")
+
+    thread._append_context("def")
+    thread._append_context("")
+    thread._append_context("ghi")
+    assert thread._context_len == 9
+    assert thread._context_since(4) == "efghi"
+    assert thread._context_since(-5) == "abcdefghi"
+    assert thread.context == "abcdefghi"
+
+    thread._context = "reset"
+    thread._append_context("!")
+    assert thread.context == "reset!"
+    assert thread._context_since(3) == "et!"
+
+
+@pytest.mark.asyncio
+async def test_tool_tail_only_scans_new_text():
+    thread = ConcreteReasoningThread()
+    await thread.initialize()
+
+    app = RiCA("test.pkg")
+    calls = []
+
+    @app.route("/echo", background=False)
+    async def echo(data):
+        calls.append(data)
+        return data
+
+    await thread.install(app)
+
+    thread._append_context('<rica package="test.pkg" route="/echo">{"n": 1}</rica>')
+    executed, _ = await thread._detect_and_execute_tool_tail()
+    assert executed
+    assert thread.context.endswith('{"n":1}')
+
+    thread._append_context(' then <rica package="test.pkg" route="/echo">{"n": 2}</rica>')
+    executed, result = await thread._detect_and_execute_tool_tail()
+    assert executed
+    assert result == '{"n":2}'
+    assert calls == [{"n": 1}, {"n": 2}]
+    assert thread._last_processed_index == thread.context.rindex("</rica>") + len("</rica>")
+
+    executed, _ = await thread._detect_and_execute_tool_tail()
+    assert not executed
+
+
+@pytest.mark.asyncio
+async def test_tool_tail_handles_tags_split_across_appends():
+    thread = ConcreteReasoningThread()
+    await thread.initialize()
+
+    app = RiCA("test.pkg")
+
+    @app.route("/echo", background=False)
+    async def echo(data):
+        return data
+
+    await thread.install(app)
+
+    thread._append_context("plain reasoning text <ri")
+    executed, _ = await thread._detect_and_execute_tool_tail()
+    assert not executed
+    assert 0 < thread._last_scanned_index <= thread.context.index("<ri")
+
+    thread._append_context('ca package="test.pkg" route="/echo">{"n": 1}')
+    executed, _ = await thread._detect_and_execute_tool_tail()
+    assert not executed
+    assert thread._last_scanned_index == thread.context.index("<rica")
+
+    thread._append_context("</rica>")
+    executed, result = await thread._detect_and_execute_tool_tail()
+    assert executed
+    assert result == '{"n":1}'
+
+
+@pytest.mark.asyncio
+async def test_non_blocking_sync_tool_runs_on_event_loop():
+    thread = ConcreteReasoningThread()
+    await thread.initialize()
+
+    app = RiCA("test.pkg")
+    seen = []
+
+    @app.route("/inline", background=False, blocking=False)
+    def inline(data):
+        seen.append(threading.current_thread())
+        return data
+
+    @app.route("/threaded", background=False)
+    def threaded(data):
+        seen.append(threading.current_thread())
+        return data
+
+    await thread.install(app)
+
+    thread._append_context('<rica package="test.pkg" route="/inline">{"a": 1}</rica>')
+    thread._append_context('<rica package="test.pkg" route="/threaded">{"b": 2}</rica>')
+    executed, result = await thread._detect_and_execute_tool_tail()
+    assert executed
+    assert result == '{"a":1}{"b":2}'
+    assert seen[0] is threading.current_thread()
+    assert seen[1] is not threading.current_thread()
+
+
+@pytest.mark.asyncio
+async def test_token_emits_do_not_wait_for_callbacks():
+    thread = ConcreteReasoningThread()
+    release = asyncio.Event()
+    received = []
+
+    @thread.token_generated
+    async def slow(piece):
+        await release.wait()
+        received.append(piece)
+
+    for piece in ["a", "b", "c"]:
+        await thread._emit_token(piece)
+    assert received == []
+
+    release.set()
+    await thread._drain_token_emits()
+    assert "".join(received) == "abc"
+
+
+@pytest.mark.asyncio
+async def test_token_backlog_is_coalesced_behind_slow_callback():
+    thread = ConcreteReasoningThread()
+    release = asyncio.Event()
+    received = []
+
+    @thread.token_generated
+    async def slow(piece):
+        await release.wait()
+        received.append(piece)
+
+    await thread._emit_token("first")
+    await asyncio.sleep(0)  # The callback is now blocked on "first".
+    tasks_before = len(asyncio.all_tasks())
+    pieces = [str(i) for i in range(1000)]
+    for piece in pieces:
+        await thread._emit_token(piece)
+
+    # Nothing new is scheduled per piece; the backlog is one list waiting for the callback.
+    assert len(asyncio.all_tasks()) == tasks_before
+    release.set()
+    await thread._drain_token_emits()
+    assert received == ["first", "".join(pieces)]
+
+
+@pytest.mark.asyncio
+async def test_route_cache_is_dropped_on_uninstall():
+    thread = ConcreteReasoningThread()
+    await thread.initialize()
+
+    app = RiCA("test.pkg")
+
+    @app.route("/echo", background=False)
+    async def echo(data):
+        return data
+
+    await thread.install(app)
+    tag = '<rica package="test.pkg" route="/echo">{"n": 1}</rica>'
+    assert await thread._parse_and_execute(tag) == '{"n":1}'
+
+    await thread.uninstall("test.pkg")
+    assert (await thread._parse_and_execute(tag)).startswith("[tool-error]PackageNotFoundError")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_initialize():
+    thread = ConcreteReasoningThread()
+    await asyncio.gather(thread.initialize(), thread.initialize())
+    assert "rica" in thread._apps
+
+
+@pytest.mark.asyncio
+async def test_token_drain_gives_up_on_hung_callback():
+    thread = ConcreteReasoningThread()
+    never = asyncio.Event()
+
+    @thread.token_generated
+    async def hung(piece):
+        await never.wait()
+
+    await thread._emit_token("a")
+    await asyncio.sleep(0)
+    await thread._emit_token("b")
+
+    await asyncio.wait_for(thread._drain_token_emits(timeout=0.05), timeout=1)
+    await asyncio.sleep(0)
+    assert thread._token_delivery.cancelled()
+    assert thread._token_pending == []
@@ -0,0 +1,46 @@
+from rica.core.whiteboard import Whiteboard
+
+
+def test_interleaved_operations_match_string_semantics():
+    wb = Whiteboard()
+    expected = {}
+
+    def read(wb_id):
+        return wb.handle({"action": "read", "whiteboard_id": wb_id})["content"]
+
+    steps = [
+        ("append", "a", "first"),
+        ("append", "a", "second"),
+        ("read", "a", None),
+        ("append", "a", "third"),
+        ("append", "b", ""),
+        ("read", "a", None),
+        ("read", "a", None),
+        ("write", "a", "reset"),
+        ("append", "a", "after reset"),
+        ("read", "a", None),
+        ("clear", "a", None),
+        ("read", "a", None),
+        ("append", "a", "after clear"),
+        ("write", "b", ""),
+        ("append", "b", "x"),
+    ]
+    for action, wb_id, content in steps:
+        if action == "read":
+            assert read(wb_id) == expected.get(wb_id, "")
+            continue
+        wb.handle({"action": action, "whiteboard_id": wb_id, "content": content})
+        # The semantics of the original single-string storage.
+        if action == "write":
+            expected[wb_id] = content
+        elif action == "append":
+            expected[wb_id] = expected.get(wb_id, "") + "\n" + content
+        elif action == "clear":
+            expected.pop(wb_id, None)
+
+    for wb_id in ("a", "b"):
+        assert read(wb_id) == expected[wb_id]
+    assert read("a") == "\nafter clear"
+    assert read("b") == "\nx"
+    listed = wb.handle({"action": "list"})["whiteboards"]
+    assert [w["id"] for w in listed] == ["b", "a"]